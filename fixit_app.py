@@ -1,12 +1,20 @@
 import streamlit as st
 import google.generativeai as genai
+from google.generativeai import caching
+from google.api_core.exceptions import BadRequest, NotFound
 from PIL import Image
+import cachetools
 import io
-import base64
 import tempfile
-import os
-from typing import List, Dict, Any
+import hashlib
+import collections
+import shutil
 import time
+import math
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import datetime
+import types
 
 # Configure the page
 st.set_page_config(
@@ -17,19 +25,23 @@ st.set_page_config(
 )
 
 # Load configuration from secrets
+@st.cache_data(ttl=3600)
+def _load_config_impl():
+    """Read configuration from Streamlit secrets; errors propagate so they aren't cached"""
+    return {
+        'api_key': st.secrets.get("gemini", {}).get("api_key", ""),
+        'title': st.secrets.get("app", {}).get("title", "RepairMate - AI Repair Assistant"),
+        'max_file_size': st.secrets.get("app", {}).get("max_file_size", 200),
+        'supported_image_formats': st.secrets.get("app", {}).get("supported_image_formats", ["png", "jpg", "jpeg", "gif", "webp"]),
+        'supported_video_formats': st.secrets.get("app", {}).get("supported_video_formats", ["mp4", "avi", "mov", "mkv"]),
+        'theme': st.secrets.get("ui", {}).get("theme", "light"),
+        'sidebar_expanded': st.secrets.get("ui", {}).get("sidebar_expanded", True)
+    }
+
 def load_config():
     """Load configuration from Streamlit secrets"""
     try:
-        config = {
-            'api_key': st.secrets.get("gemini", {}).get("api_key", ""),
-            'title': st.secrets.get("app", {}).get("title", "RepairMate - AI Repair Assistant"),
-            'max_file_size': st.secrets.get("app", {}).get("max_file_size", 200),
-            'supported_image_formats': st.secrets.get("app", {}).get("supported_image_formats", ["png", "jpg", "jpeg", "gif", "webp"]),
-            'supported_video_formats': st.secrets.get("app", {}).get("supported_video_formats", ["mp4", "avi", "mov", "mkv"]),
-            'theme': st.secrets.get("ui", {}).get("theme", "light"),
-            'sidebar_expanded': st.secrets.get("ui", {}).get("sidebar_expanded", True)
-        }
-        return config
+        return _load_config_impl()
     except Exception as e:
         st.error(f"❌ Error loading configuration: {str(e)}")
         return {
@@ -44,9 +56,22 @@ def load_config():
 
 # Load app configuration
 config = load_config()
+cfg = types.SimpleNamespace(**config)
+
+# Static values derived from config
+ALL_FORMATS = tuple(cfg.supported_image_formats + cfg.supported_video_formats)
+UPLOAD_HELP = f"Upload a clear image or video showing the issue (max {cfg.max_file_size}MB)"
+EXAMPLE_ISSUES = (
+    "My phone screen is cracked",
+    "Laptop won't charge",
+    "Car won't start",
+    "Washing machine leaking",
+    "TV has no sound",
+    "Router keeps disconnecting"
+)
 
 # Custom CSS for better styling
-st.markdown("""
+_CSS = """
 <style>
     .main-header {
         background: linear-gradient(90deg, #667eea 0%, #764ba2 100%);
@@ -57,23 +82,6 @@ st.markdown("""
         text-align: center;
     }
     
-    .chat-message {
-        padding: 1rem;
-        border-radius: 10px;
-        margin: 1rem 0;
-        border-left: 4px solid #667eea;
-    }
-    
-    .user-message {
-        background-color: #f0f2f6;
-        border-left-color: #ff6b6b;
-    }
-    
-    .assistant-message {
-        background-color: #e8f5e8;
-        border-left-color: #51cf66;
-    }
-    
     .step-counter {
         background: #667eea;
         color: white;
@@ -107,15 +115,30 @@ st.markdown("""
         background-color: #f9f9f9;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# Streamlit drops elements that a rerun does not emit, so the styles are sent every run
+st.markdown(_CSS, unsafe_allow_html=True)
+
+# Bounds on the conversation kept for display and sent to Gemini as context
+MAX_DISPLAY_MESSAGES = 40
+MAX_CONTEXT_MESSAGES = 10
 
 # Initialize session state
 if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
+    st.session_state.chat_history = collections.deque(maxlen=MAX_DISPLAY_MESSAGES)
 if 'uploaded_media' not in st.session_state:
     st.session_state.uploaded_media = None
 if 'media_type' not in st.session_state:
     st.session_state.media_type = None
+if 'media_hash' not in st.session_state:
+    st.session_state.media_hash = None
+if 'upload_future' not in st.session_state:
+    st.session_state.upload_future = None
+if 'upload_mime' not in st.session_state:
+    st.session_state.upload_mime = None
+if 'upload_meta' not in st.session_state:
+    st.session_state.upload_meta = {}
 if 'conversation_started' not in st.session_state:
     st.session_state.conversation_started = False
 if 'assistant' not in st.session_state:
@@ -123,11 +146,7 @@ if 'assistant' not in st.session_state:
 if 'user_input' not in st.session_state:
     st.session_state.user_input = ""
 
-class RepairMateAssistant:
-    def __init__(self, api_key: str):
-        try:
-            genai.configure(api_key=api_key)
-            self.system_instruction = """You are an expert repair assistant called RepairMate AI. Your role is to help users diagnose and fix issues with their devices, appliances, or objects based on images/videos they share and their descriptions.
+SYSTEM_INSTRUCTION = """You are an expert repair assistant called RepairMate AI. Your role is to help users diagnose and fix issues with their devices, appliances, or objects based on images/videos they share and their descriptions.
 
 Guidelines for your responses:
 1. Always be helpful, clear, and safety-conscious
@@ -141,135 +160,402 @@ Guidelines for your responses:
 9. Include difficulty level (Easy/Medium/Hard) for each repair step
 
 Start by analyzing any media provided and asking clarifying questions about the problem. Get relevant information such as device type, model number if relevant, recent repairs, and symptoms. Then guide the user through diagnosing and fixing the issue step-by-step."""
-            
-            self.model = genai.GenerativeModel(
-                "gemini-2.0-flash-lite",
-                system_instruction=self.system_instruction
-            )
+
+MODEL_NAME = "gemini-2.0-flash-lite"
+
+# Markdown shown for each chat message
+USER_TEMPLATE = "**You:**\n\n{content}"
+ASSISTANT_TEMPLATE = "**RepairMate AI:**\n\n{content}"
+
+@st.cache_resource
+def get_model(api_key: str):
+    """Configure Gemini and build the model once per API key, shared across sessions"""
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(
+        MODEL_NAME,
+        system_instruction=SYSTEM_INSTRUCTION
+    )
+
+# Gemini's minimum cacheable context is a few thousand tokens, roughly 15s of video
+MIN_CACHE_VIDEO_SECONDS = 20
+
+# Models that rejected context caching, so later sessions skip the failing call
+_caching_unsupported = set()
+
+def _is_caching_unsupported(error):
+    """True if Gemini rejected context caching for the model itself, not for this content"""
+    message = str(error).lower()
+    return 'createcachedcontent' in message or 'not supported' in message
+
+def _video_seconds(video_file):
+    """Duration Gemini reports for a processed video, or 0 if unknown"""
+    try:
+        return video_file.video_metadata.video_duration.total_seconds()
+    except Exception:
+        return 0
+
+# Replies to identical opening messages (e.g. the quick examples), shared across sessions
+_response_cache = cachetools.TTLCache(maxsize=512, ttl=3600)
+_response_cache_lock = threading.Lock()
+
+class RepairMateAssistant:
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        try:
+            self.system_instruction = SYSTEM_INSTRUCTION
+            self.model = get_model(api_key)
             self.chat = None
+            self.cache = None
+            # Index in chat history of the user turn that carried inline media
+            self._media_turn = None
             self.api_configured = True
         except Exception as e:
             self.api_configured = False
             st.error(f"❌ Error configuring Gemini API: {str(e)}")
         
-    def start_chat(self):
-        """Initialize a new chat session"""
+    def start_chat(self, history=None):
+        """Initialize a new chat session, optionally seeded with prior history"""
         if not self.api_configured:
             return None
             
         try:
-            # Start chat with empty history - system instruction is already in the model
-            self.chat = self.model.start_chat(history=[])
+            # System instruction is already in the model, so history only holds turns
+            self.chat = self.model.start_chat(history=history or [])
+            self._media_turn = None
             return self.chat
         except Exception as e:
             st.error(f"❌ Error starting chat: {str(e)}")
             return None
     
-    def send_message(self, message: str, media_data=None):
-        """Send a message to Gemini with optional media"""
+    def _start_cached_chat(self, media_data):
+        """Start a chat on a Gemini context cache holding the system instruction and media"""
+        if MODEL_NAME in _caching_unsupported or _video_seconds(media_data) < MIN_CACHE_VIDEO_SECONDS:
+            return False
+        try:
+            self.cache = caching.CachedContent.create(
+                model=MODEL_NAME,
+                system_instruction=self.system_instruction,
+                contents=[media_data],
+                ttl=datetime.timedelta(hours=1)
+            )
+            model = genai.GenerativeModel.from_cached_content(cached_content=self.cache)
+            self.chat = model.start_chat(history=[])
+            return True
+        except (BadRequest, NotFound) as e:
+            # Only a model that can't cache is remembered; content errors fall back for this turn
+            if _is_caching_unsupported(e):
+                _caching_unsupported.add(MODEL_NAME)
+            self._drop_cache()
+            return False
+        except Exception:
+            self._drop_cache()
+            return False
+    
+    def _drop_cache(self):
+        """Delete this session's context cache instead of leaving it billed until it expires"""
+        if self.cache is not None:
+            try:
+                self.cache.delete()
+            except Exception:
+                pass
+            self.cache = None
+    
+    def reset(self):
+        """Forget the current conversation and its context cache"""
+        self._drop_cache()
+        self.chat = None
+        self._media_turn = None
+    
+    def _trim_history(self):
+        """Keep the exchange that carried media plus the most recent turns"""
+        history = self.chat.history
+        cut = len(history) - MAX_CONTEXT_MESSAGES
+        if cut <= 0:
+            return
+        media_turn = self._media_turn
+        if media_turn is not None and media_turn < cut:
+            # The media exchange would fall out of the window, so pin it at the front
+            self.chat.history = history[media_turn:media_turn + 2] + history[cut:]
+            self._media_turn = 0
+        else:
+            self.chat.history = history[cut:]
+            if media_turn is not None:
+                self._media_turn = media_turn - cut
+    
+    def _stream_response(self, response, placeholder=None):
+        """Accumulate a streamed response, rendering it into placeholder as chunks arrive"""
+        buffer = ""
+        for chunk in response:
+            # Blocked or empty chunks carry no parts, and .text would raise on them
+            if not chunk.candidates or not chunk.candidates[0].content.parts:
+                continue
+            buffer += chunk.text
+            if placeholder is not None:
+                placeholder.markdown(ASSISTANT_TEMPLATE.format(content=buffer))
+        return buffer
+    
+    def _send(self, content, placeholder=None):
+        """Send content on the current chat session and stream the reply"""
+        # content is [media, message] when this turn carries media worth keeping when trimming
+        media_turn = len(self.chat.history) if len(content) > 1 else self._media_turn
+        response = self.chat.send_message(content, stream=True)
+        try:
+            text = self._stream_response(response, placeholder)
+            # Raises if the stream was cut off or ended on SAFETY/RECITATION
+            self.chat.history
+            self._media_turn = media_turn
+            return text
+        except BaseException:
+            # Also catches Streamlit's rerun/stop interrupts, which aren't Exception subclasses
+            self._discard_pending_turn()
+            raise
+    
+    def _discard_pending_turn(self):
+        """Drop an unfinished request/response pair, otherwise every later message fails too"""
+        try:
+            self.chat.rewind()
+        except Exception:
+            # rewind() can't read a half-consumed stream, so start over instead
+            self.reset()
+    
+    def send_message(self, message: str, media_data=None, placeholder=None, media_hash=None):
+        """Send a message to Gemini with optional media, streaming into placeholder"""
         if not self.api_configured:
             return "❌ API not configured properly. Please check your API key."
+        
+        if self.chat is not None:
+            try:
+                self.chat.history
+            except Exception:
+                # The previous reply never finished (e.g. a rerun interrupted its stream)
+                self._discard_pending_turn()
+        
+        content = [media_data, message] if media_data is not None else [message]
+        to_send = content
             
         try:
+            # Only opening turns are cached, so a reply never depends on earlier context
+            cache_key = None
+            if self.chat is None and (media_data is None or media_hash):
+                cache_key = hashlib.sha256(
+                    (self.system_instruction + (media_hash or '') + message).encode()
+                ).hexdigest()
+                with _response_cache_lock:
+                    cached = _response_cache.get(cache_key)
+                if cached is not None:
+                    # Seed the chat with the cached exchange so follow-ups keep context
+                    self.start_chat(history=[
+                        {'role': 'user', 'parts': content},
+                        {'role': 'model', 'parts': [cached]}
+                    ])
+                    if media_data is not None:
+                        self._media_turn = 0
+                    if placeholder is not None:
+                        placeholder.markdown(ASSISTANT_TEMPLATE.format(content=cached))
+                    return cached
+            
             # Initialize chat if not already started
             if self.chat is None:
-                self.start_chat()
+                # Videos are large enough to cache, so later turns reuse them without prefill
+                if media_data is not None and not isinstance(media_data, dict) and self._start_cached_chat(media_data):
+                    # The media already lives in the context cache
+                    to_send = [message]
+                else:
+                    self.start_chat()
                 if not self.chat:
                     return "❌ Failed to start chat session."
             
-            # Prepare message content
-            content = []
-            if media_data:
-                content.append(media_data)
-            content.append(message)
-            
-            # Send message
-            if len(content) > 1:
-                response = self.chat.send_message(content)
-            else:
-                response = self.chat.send_message(message)
-            
-            return response.text
+            text = self._send(to_send, placeholder)
+            self._trim_history()
+            if cache_key is not None:
+                with _response_cache_lock:
+                    _response_cache[cache_key] = text
+            return text
             
+        except BadRequest as e:
+            # A 400 usually means the session history was rejected, so restart the chat session
+            try:
+                self.reset()
+                self.start_chat()
+                if self.chat:
+                    return self._send(content, placeholder)
+            except Exception:
+                pass
+            return f"❌ Error: {str(e)}. Please try again or check your API key."
         except Exception as e:
-            error_msg = str(e)
-            if "400" in error_msg or "role" in error_msg.lower():
-                # Try to restart the chat session
-                try:
-                    self.chat = None
-                    self.start_chat()
-                    if self.chat:
-                        if media_data:
-                            response = self.chat.send_message([media_data, message])
-                        else:
-                            response = self.chat.send_message(message)
-                        return response.text
-                except:
-                    pass
-            return f"❌ Error: {error_msg}. Please try again or check your API key."
-
-def process_uploaded_file(uploaded_file, config):
+            return f"❌ Error: {str(e)}. Please try again or check your API key."
+
+MAX_IMAGE_EDGE = 1568
+SPOOL_MAX_SIZE = 50 * 1024 * 1024
+
+# Small images in these formats are sent with their original bytes
+SEND_AS_IS_FORMATS = {'JPEG', 'PNG', 'WEBP'}
+
+# Seconds to wait for Gemini to process a video, and for the whole upload at send time
+VIDEO_PROCESSING_TIMEOUT = 300
+VIDEO_UPLOAD_TIMEOUT = VIDEO_PROCESSING_TIMEOUT + 60
+
+# Browser-reported video types mapped to ones Gemini accepts; anything else goes up as
+# video/mp4, which the old .mp4 temp-file suffix made every upload
+GEMINI_VIDEO_MIME = {
+    'video/mp4': 'video/mp4',
+    'video/mpeg': 'video/mpeg',
+    'video/quicktime': 'video/mov',
+    'video/x-msvideo': 'video/avi',
+    'video/avi': 'video/avi',
+    'video/webm': 'video/webm',
+    'video/x-flv': 'video/x-flv',
+    'video/3gpp': 'video/3gpp',
+    'video/x-ms-wmv': 'video/wmv'
+}
+
+# Gemini's SDK is synchronous, so video uploads run here to keep reruns responsive
+_executor = ThreadPoolExecutor(max_workers=4)
+
+def _upload_and_wait(video, mime: str):
+    """Upload a video to Gemini and wait for processing to finish"""
+    try:
+        video_file = genai.upload_file(video, mime_type=GEMINI_VIDEO_MIME.get(mime, 'video/mp4'))
+        
+        # Wait for video processing, backing off from 0.2s up to 1s between polls
+        deadline = time.monotonic() + VIDEO_PROCESSING_TIMEOUT
+        delay = 0.2
+        while video_file.state.name == "PROCESSING":
+            if time.monotonic() > deadline:
+                raise TimeoutError("Gemini took too long to process this video")
+            time.sleep(delay)
+            delay = min(delay * 2, 1)
+            video_file = genai.get_file(video_file.name)
+        
+        if video_file.state.name == "FAILED":
+            raise RuntimeError("Gemini could not process this video")
+        
+        return video_file
+    finally:
+        # Clean up temp file
+        video.close()
+
+# Gemini deletes uploaded files after 48h, so cached video handles must expire well before that
+@st.cache_resource(show_spinner=False, ttl=datetime.timedelta(hours=6), max_entries=64)
+def _process_upload(file_hash: str, _source, mime: str):
+    """Decode an image or start a background video upload, memoized on the file content hash"""
+    _source.seek(0)
+    if mime.startswith('image/'):
+        image = Image.open(_source)
+        scale = MAX_IMAGE_EDGE / max(image.size)
+        if image.format == 'JPEG' and scale < 1:
+            # Let libjpeg downscale during decode; the box keeps the aspect ratio so
+            # Pillow can pick a real 1/2-1/8 scale, and the result is never below it
+            image.draft('RGB', (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+        image.load()
+        # Gemini downsamples internally, so don't ship pixels it would discard
+        if max(image.size) <= MAX_IMAGE_EDGE and image.format in SEND_AS_IS_FORMATS:
+            _source.seek(0)
+            return {'mime_type': Image.MIME[image.format], 'data': _source.read()}, 'image'
+        image.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.LANCZOS)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        # Pre-encode as JPEG; the SDK would otherwise send an in-memory image as lossless WebP
+        buf = io.BytesIO()
+        image.save(buf, 'JPEG', quality=85)
+        return {'mime_type': 'image/jpeg', 'data': buf.getvalue()}, 'image'
+        
+    elif mime.startswith('video/'):
+        # For videos, copy in 1MB chunks to a temp file that only spills to disk when large
+        video = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        shutil.copyfileobj(_source, video, length=1024 * 1024)
+        video.seek(0)
+        
+        # Returns a Future resolving to the Gemini video file
+        return _executor.submit(_upload_and_wait, video, mime), 'video'
+    else:
+        return None, None
+
+def _forget_upload(file_hash: str, mime: str):
+    """Drop one failed upload from the cache so only that file is retried"""
+    # _source is excluded from the cache key, so any value selects the entry
+    _process_upload.clear(file_hash, None, mime)
+
+PREVIEW_EDGE = 512
+
+@st.cache_data(show_spinner=False, ttl=datetime.timedelta(hours=6), max_entries=64)
+def _preview_bytes(file_hash: str, _image) -> bytes:
+    """Encode a small JPEG preview of an uploaded image, memoized on the file content hash"""
+    # Start from the already downsampled image bytes rather than the full upload
+    image = Image.open(io.BytesIO(_image['data']))
+    image.draft('RGB', (PREVIEW_EDGE, PREVIEW_EDGE))
+    image.thumbnail((PREVIEW_EDGE, PREVIEW_EDGE))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    buf = io.BytesIO()
+    image.save(buf, 'JPEG', quality=85)
+    return buf.getvalue()
+
+def process_uploaded_file(uploaded_file, cfg):
     """Process uploaded image or video file"""
-    file_size_mb = len(uploaded_file.getvalue()) / (1024 * 1024)
+    # Size and content hash are computed once per uploaded file, not on every rerun
+    meta = st.session_state.upload_meta
+    fid = uploaded_file.file_id
+    if fid not in meta:
+        uploaded_file.seek(0)
+        meta[fid] = {
+            'size': uploaded_file.size,
+            'sha': hashlib.file_digest(uploaded_file, 'sha256').hexdigest()
+        }
+    file_size_mb = meta[fid]['size'] / (1024 * 1024)
     
-    if file_size_mb > config['max_file_size']:
-        st.error(f"❌ File size ({file_size_mb:.1f}MB) exceeds limit of {config['max_file_size']}MB")
-        return None, None
+    if file_size_mb > cfg.max_file_size:
+        st.error(f"❌ File size ({file_size_mb:.1f}MB) exceeds limit of {cfg.max_file_size}MB")
+        return None, None, None
     
-    if uploaded_file.type.startswith('image/'):
-        try:
-            image = Image.open(uploaded_file)
-            return image, 'image'
-        except Exception as e:
-            st.error(f"❌ Error processing image: {str(e)}")
-            return None, None
-            
-    elif uploaded_file.type.startswith('video/'):
-        try:
-            # For videos, we'll save temporarily and create a video object
-            tfile = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4')
-            tfile.write(uploaded_file.read())
-            tfile.close()
-            
-            # Create a video file object for Gemini
-            video_file = genai.upload_file(path=tfile.name)
-            
-            # Wait for video processing
-            while video_file.state.name == "PROCESSING":
-                time.sleep(1)
-                video_file = genai.get_file(video_file.name)
-            
-            # Clean up temp file
-            os.unlink(tfile.name)
-            
-            return video_file, 'video'
-        except Exception as e:
-            st.error(f"❌ Error processing video: {str(e)}")
-            return None, None
-    else:
-        return None, None
+    file_hash = meta[fid]['sha']
+    try:
+        media_data, media_type = _process_upload(file_hash, uploaded_file, uploaded_file.type)
+        return media_data, media_type, file_hash
+    except Exception as e:
+        kind = 'video' if uploaded_file.type.startswith('video/') else 'image'
+        st.error(f"❌ Error processing {kind}: {str(e)}")
+        return None, None, None
 
-# Main UI
-st.markdown(f"""
+_HEADER_HTML = f"""
 <div class="main-header">
-    <h1>🔧 {config['title']}</h1>
+    <h1>🔧 {cfg.title}</h1>
     <p>Upload an image or video of your broken item and get expert repair guidance!</p>
 </div>
-""", unsafe_allow_html=True)
+"""
+
+_CONFIG_ERROR_HTML = """
+<div class="config-status config-error">
+    ❌ <strong>API Configuration:</strong> Gemini API key not found in secrets.toml
+</div>
+"""
+
+def get_assistant(api_key: str) -> RepairMateAssistant:
+    """Return this session's assistant, rebuilding it only when the API key changes"""
+    assistant = st.session_state.assistant
+    if assistant is None or assistant.api_key != api_key:
+        assistant = st.session_state.assistant = RepairMateAssistant(api_key)
+    return assistant
+
+@st.fragment(run_every=0.25)
+def render_upload_status():
+    """Show a progress note while the video uploads, then rerun the app to pick it up"""
+    if st.session_state.upload_future.done():
+        st.rerun()
+    st.info("⏳ Processing video…")
+
+# Main UI
+st.markdown(_HEADER_HTML, unsafe_allow_html=True)
 
 # Check if API key is configured
-api_configured = bool(config['api_key'])
+api_configured = bool(cfg.api_key)
 
 if not api_configured:
-    st.markdown("""
-    <div class="config-status config-error">
-        ❌ <strong>API Configuration:</strong> Gemini API key not found in secrets.toml
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(_CONFIG_ERROR_HTML, unsafe_allow_html=True)
 
 # Initialize assistant if not already done
-if api_configured and st.session_state.assistant is None:
-    st.session_state.assistant = RepairMateAssistant(config['api_key'])
+if api_configured:
+    get_assistant(cfg.api_key)
 
 # Sidebar
 with st.sidebar:
@@ -291,7 +577,7 @@ with st.sidebar:
     #     )
         
     #     if manual_api_key:
-    #         st.session_state.assistant = RepairMateAssistant(manual_api_key)
+    #         get_assistant(manual_api_key)
     #         st.success("✅ Manual API Key configured!")
     #         api_configured = True
     
@@ -300,45 +586,73 @@ with st.sidebar:
     # Upload Media Section in Sidebar
     st.header("📤 Upload Media")
     
-    # Create list of supported formats
-    all_formats = config['supported_image_formats'] + config['supported_video_formats']
-    
     uploaded_file = st.file_uploader(
         "Choose an image or video file",
-        type=all_formats,
-        help=f"Upload a clear image or video showing the issue (max {config['max_file_size']}MB)"
+        type=ALL_FORMATS,
+        help=UPLOAD_HELP
     )
     
+    st.session_state.upload_future = None
+    
     if uploaded_file:
-        media_data, media_type = process_uploaded_file(uploaded_file, config)
+        media_data, media_type, media_hash = process_uploaded_file(uploaded_file, cfg)
+        
+        if media_type == 'video' and media_data:
+            st.video(uploaded_file)
+            if not media_data.done():
+                # Sending waits on this future, so the user can keep typing meanwhile
+                st.session_state.upload_future = media_data
+                st.session_state.uploaded_media = None
+                st.session_state.media_type = media_type
+                st.session_state.media_hash = media_hash
+                st.session_state.upload_mime = uploaded_file.type
+                render_upload_status()
+                media_data = None
+            else:
+                try:
+                    media_data = media_data.result()
+                except Exception as e:
+                    st.error(f"❌ Error processing video: {str(e)}")
+                    # Drop the failed upload so the next rerun retries it
+                    _forget_upload(media_hash, uploaded_file.type)
+                    media_data = None
         
         if media_data and media_type:
             st.session_state.uploaded_media = media_data
             st.session_state.media_type = media_type
+            st.session_state.media_hash = media_hash
             
             if media_type == 'image':
-                st.image(media_data, caption="Uploaded Image", use_container_width=True)
-            elif media_type == 'video':
-                st.video(uploaded_file)
+                # Show a small pre-encoded preview; the full image is only needed for Gemini
+                st.image(_preview_bytes(media_hash, media_data), caption="Uploaded Image", use_container_width=True)
             
             st.success(f"✅ {media_type.title()} uploaded!")
             
             # Display file info
-            file_size = len(uploaded_file.getvalue()) / (1024 * 1024)
+            file_size = st.session_state.upload_meta[uploaded_file.file_id]['size'] / (1024 * 1024)
             st.info(f"📊 Size: {file_size:.1f}MB")
     
     st.markdown("---")
     
     if st.button("🔄 Start New Session"):
-        st.session_state.chat_history = []
+        st.session_state.chat_history = collections.deque(maxlen=MAX_DISPLAY_MESSAGES)
         st.session_state.uploaded_media = None
         st.session_state.media_type = None
+        st.session_state.media_hash = None
         st.session_state.conversation_started = False
         st.session_state.user_input = ""
         if st.session_state.assistant:
-            st.session_state.assistant.chat = None
+            st.session_state.assistant.reset()
         st.rerun()
 
+ROLE_AVATARS = {'user': "🙋‍♂️", 'assistant': "🔧"}
+
+def render_chat():
+    """Render the chat history"""
+    for message in st.session_state.chat_history:
+        with st.chat_message(message['role'], avatar=message['avatar']):
+            st.markdown(message['rendered'])
+
 # Main Chat Area
 st.header("💬 Repair Assistant Chat")
 
@@ -348,116 +662,122 @@ with st.container():
 
     with chat_container:
         if st.session_state.chat_history:
-            for i, message in enumerate(st.session_state.chat_history):
-                if message["role"] == "user":
-                    with st.chat_message("user", avatar="🙋‍♂️"):
-                        st.markdown(f"**You:**\n\n{message['content']}")
-                else:
-                    with st.chat_message("assistant", avatar="🔧"):
-                        st.markdown(f"**RepairMate AI:**\n\n{message['content']}")
-    
-    # with chat_container:
-    #     if st.session_state.chat_history:
-    #         for i, message in enumerate(st.session_state.chat_history):
-    #             if message['role'] == 'user':
-    #                 st.markdown(f"""
-    #                 <div class="chat-message user-message">
-    #                     <strong>🙋‍♂️ You:</strong><br>
-    #                     {message['content']}
-    #                 </div>
-    #                 """, unsafe_allow_html=True)
-    #             else:
-    #                 st.markdown(f"""
-    #                 <div class="chat-message assistant-message">
-    #                     <strong>🔧 RepairMate AI:</strong><br>
-    #                     {message['content']}
-    #                 </div>
-    #                 """, unsafe_allow_html=True)
+            render_chat()
         else:
             st.info("👋 Welcome! Upload an image/video of your broken item in the sidebar and describe the issue below to get started.")
 
+def _set_input(val):
+    """Fill the issue description from a quick example"""
+    st.session_state.user_input = val
+
 # Input section
 st.subheader("✍️ Describe Your Issue")
 
-# Text area with session state
-user_input = st.text_area(
-    "What's wrong with your item?",
-    value=st.session_state.user_input,
-    placeholder="Describe the problem in detail. For example: 'My phone screen is cracked and not responding to touch' or 'My laptop won't turn on after I spilled water on it'",
-    height=100,
-    key="user_input_area"
-)
-
-# Update session state with current value
-st.session_state.user_input = user_input
+# Text area and send button share a form, so typing doesn't rerun the script
+with st.form("send_form", clear_on_submit=True, border=False):
+    user_input = st.text_area(
+        "What's wrong with your item?",
+        value=st.session_state.user_input,
+        placeholder="Describe the problem in detail. For example: 'My phone screen is cracked and not responding to touch' or 'My laptop won't turn on after I spilled water on it'",
+        height=100,
+        key="user_input_area"
+    )
+    
+    # A second submit while a reply is streaming interrupts that run; the send handler
+    # only records a turn once its reply completes, so the interrupted one is dropped
+    send_button = st.form_submit_button(
+        "🚀 Send Message",
+        type="primary",
+        use_container_width=True
+    )
 
 # Quick examples (only show when no conversation has started)
 if not st.session_state.chat_history:
     st.subheader("💡 Quick Examples")
     
-    example_issues = [
-        "My phone screen is cracked",
-        "Laptop won't charge",
-        "Car won't start",
-        "Washing machine leaking",
-        "TV has no sound",
-        "Router keeps disconnecting"
-    ]
-    
-    col1, col2, col3 = st.columns(3)
-    
-    for i, example in enumerate(example_issues):
-        col_index = i % 3
-        if col_index == 0:
-            with col1:
-                if st.button(f"💡 {example}", key=f"example_{i}", use_container_width=True):
-                    st.session_state.user_input = example
-                    st.rerun()
-        elif col_index == 1:
-            with col2:
-                if st.button(f"💡 {example}", key=f"example_{i}", use_container_width=True):
-                    st.session_state.user_input = example
-                    st.rerun()
-        else:
-            with col3:
-                if st.button(f"💡 {example}", key=f"example_{i}", use_container_width=True):
-                    st.session_state.user_input = example
-                    st.rerun()
-
-# Send button
-send_button = st.button("🚀 Send Message", type="primary", use_container_width=True)
+    cols = st.columns(3)
+    for i, example in enumerate(EXAMPLE_ISSUES):
+        cols[i % 3].button(
+            f"💡 {example}",
+            key=f"example_{i}",
+            use_container_width=True,
+            on_click=_set_input,
+            args=(example,)
+        )
 
 # Process user input
 if send_button and user_input and api_configured:
     if not st.session_state.assistant:
         st.error("❌ Assistant not initialized. Please check your API configuration!")
     else:
-        # Add user message to chat history
-        st.session_state.chat_history.append({
+        # A video still uploading in the background is only waited on now, at send time
+        upload_error = None
+        if st.session_state.upload_future is not None:
+            with st.spinner("⏳ Waiting for video processing..."):
+                try:
+                    st.session_state.uploaded_media = st.session_state.upload_future.result(
+                        timeout=VIDEO_UPLOAD_TIMEOUT
+                    )
+                except Exception as e:
+                    upload_error = str(e) or type(e).__name__
+                    _forget_upload(st.session_state.media_hash, st.session_state.upload_mime)
+        
+        if upload_error is not None:
+            # Don't answer without the video the user thinks is attached; record why instead
+            error_text = f"❌ Error processing video: {upload_error}. Your message was not sent; please upload the video again and resend."
+            st.session_state.chat_history.append({
+                'role': 'user',
+                'avatar': ROLE_AVATARS['user'],
+                'content': user_input,
+                'rendered': USER_TEMPLATE.format(content=user_input)
+            })
+            st.session_state.chat_history.append({
+                'role': 'assistant',
+                'avatar': ROLE_AVATARS['assistant'],
+                'content': error_text,
+                'rendered': ASSISTANT_TEMPLATE.format(content=error_text)
+            })
+            st.rerun()
+        
+        # Kept out of chat history until the reply completes, so an interrupted send leaves no trace
+        user_message = {
             'role': 'user',
-            'content': user_input
-        })
+            'avatar': ROLE_AVATARS['user'],
+            'content': user_input,
+            'rendered': USER_TEMPLATE.format(content=user_input)
+        }
         
         # Prepare the message for Gemini
         message_content = user_input
         if not st.session_state.conversation_started and st.session_state.uploaded_media:
             message_content = f"I have uploaded a {st.session_state.media_type} showing an issue. Here's my description of the problem: {user_input}. Please analyze the {st.session_state.media_type} and help me fix this issue step by step. Please provide detailed instructions and mention any tools I might need."
             media_to_send = st.session_state.uploaded_media
-            st.session_state.conversation_started = True
         else:
             media_to_send = None
         
-        # Get AI response
-        with st.spinner("🤔 RepairMate AI is analyzing..."):
+        with st.chat_message("user", avatar=ROLE_AVATARS['user']):
+            st.markdown(user_message['rendered'])
+        
+        # Stream AI response into the chat as it is generated
+        with st.chat_message("assistant", avatar=ROLE_AVATARS['assistant']):
+            placeholder = st.empty()
+            placeholder.markdown("🤔 _RepairMate AI is analyzing..._")
             response = st.session_state.assistant.send_message(
                 message_content, 
-                media_to_send
+                media_to_send,
+                placeholder,
+                st.session_state.media_hash
             )
         
-        # Add AI response to chat history
+        # Add the exchange to chat history
+        if media_to_send is not None:
+            st.session_state.conversation_started = True
+        st.session_state.chat_history.append(user_message)
         st.session_state.chat_history.append({
             'role': 'assistant',
-            'content': response
+            'avatar': ROLE_AVATARS['assistant'],
+            'content': response,
+            'rendered': ASSISTANT_TEMPLATE.format(content=response)
         })
         
         # Clear input and rerun